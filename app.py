@@ -17,8 +17,9 @@ from supabase import create_client, Client
 load_dotenv()
 
 # Initialize Supabase client
+@st.cache_resource
 def get_supabase_client():
-    """Get Supabase client if credentials are available"""
+    """Get Supabase client if credentials are available (created once and reused)"""
     supabase_url = os.getenv('SUPABASE_URL')
     supabase_key = os.getenv('SUPABASE_KEY')
     
@@ -114,23 +115,27 @@ if 'bot_process' not in st.session_state:
 if 'bot_output' not in st.session_state:
     st.session_state.bot_output = []
 
+@st.cache_resource
+def get_gspread_client():
+    """Get an authorized gspread client (created once and reused)"""
+    # Try environment variable first
+    creds_json = os.getenv('GOOGLE_CREDS_JSON')
+    if creds_json:
+        creds_dict = json.loads(creds_json)
+        scope = [
+            "https://spreadsheets.google.com/feeds",
+            "https://www.googleapis.com/auth/drive"
+        ]
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)  # type: ignore
+        return gspread.authorize(creds)  # type: ignore
+    # Fallback to file-based credentials
+    return gspread.service_account(filename='gcredentials.json')
+
 def get_google_sheets_data():
     """Get data from Google Sheets"""
     try:
-        # Try environment variable first
-        creds_json = os.getenv('GOOGLE_CREDS_JSON')
-        if creds_json:
-            creds_dict = json.loads(creds_json)
-            scope = [
-                "https://spreadsheets.google.com/feeds",
-                "https://www.googleapis.com/auth/drive"
-            ]
-            creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)  # type: ignore
-            gc = gspread.authorize(creds)  # type: ignore
-        else:
-            # Fallback to file-based credentials
-            gc = gspread.service_account(filename='gcredentials.json')
-        
+        gc = get_gspread_client()
+
         # Open sheet
         sheet_name = os.getenv('GOOGLE_SHEET_NAME', 'Recap Visit YOVI')
         sheet = gc.open(sheet_name).sheet1
@@ -148,10 +153,10 @@ def get_google_sheets_data():
 def start_bot():
     """Start the bot in a separate thread with better error handling"""
     try:
-        # Only use bot.py
-        bot_file = 'bot.py'
+        # The bot entry point is main.py
+        bot_file = 'main.py'
         if not os.path.exists(bot_file):
-            st.error("bot.py file not found!")
+            st.error("main.py file not found!")
             return False
         
         # Use the same Python executable as Streamlit
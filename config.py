@@ -7,6 +7,11 @@ import os
 import json
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Load environment variables
 load_dotenv()
 
@@ -39,6 +44,14 @@ SUPABASE_BUCKET = "photo"
 CHANNEL_ID = -1002591459174  # Replace with your channel ID
 
 # Parse Google credentials
+_google_creds_dict = None
+
 def get_google_credentials_dict():
-    """Parse Google credentials from environment variable."""
-    return json.loads(GOOGLE_CREDS_JSON)
\ No newline at end of file
+    """Parse Google credentials from environment variable (parsed once)."""
+    global _google_creds_dict
+    if _google_creds_dict is None:
+        if orjson is not None:
+            _google_creds_dict = orjson.loads(GOOGLE_CREDS_JSON)
+        else:
+            _google_creds_dict = json.loads(GOOGLE_CREDS_JSON)
+    return _google_creds_dict
\ No newline at end of file
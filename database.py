@@ -3,8 +3,12 @@ Database operations module for Google Sheets integration.
 Handles user credentials, data storage, and record retrieval.
 """
 
+import asyncio
+import functools
 import gspread
 import logging
+import time
+from itertools import zip_longest
 from typing import Dict, Optional, List
 from oauth2client.service_account import ServiceAccountCredentials
 from config import get_google_credentials_dict, GOOGLE_SCOPE, SHEET_NAME
@@ -13,98 +17,319 @@ from timezone_utils import format_timestamp
 
 logger = logging.getLogger(__name__)
 
+# How long cached credentials stay valid (seconds)
+CREDENTIALS_CACHE_TTL = 300
+
+# How long the per-user record index stays valid (seconds)
+RECORD_INDEX_TTL = 300
+
+# Columns needed for the record index: No, Timestamp, ID, Nama Usaha, PIC
+RECORD_INDEX_RANGES = ['A2:A', 'B2:B', 'C2:C', 'J2:J', 'L2:L']
+
+# Batched append settings: flush when this many rows are queued or
+# after this many seconds, whichever comes first
+BATCH_MAX_ROWS = 20
+BATCH_MAX_WAIT = 5.0
+
+# How often to refresh the OAuth access token in the background
+# (tokens last an hour; refresh with ten minutes to spare)
+TOKEN_REFRESH_INTERVAL = 3000
+
+# Retry settings for transient Sheets API errors (quota / server side)
+RETRY_STATUS_CODES = (429, 500, 503)
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0
+
+def retry_on_quota_error(func):
+    """Retry a gspread call with exponential backoff on 429/500/503."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(RETRY_MAX_ATTEMPTS):
+            try:
+                return func(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                status = e.response.status_code
+                if (status not in RETRY_STATUS_CODES or
+                        attempt == RETRY_MAX_ATTEMPTS - 1):
+                    raise
+                delay = RETRY_BASE_DELAY * (2 ** attempt)
+                logger.warning(
+                    f"Sheets API error {status}, retrying in {delay:.0f}s"
+                )
+                time.sleep(delay)
+    return wrapper
+
 class GoogleSheetsManager:
     """Manages Google Sheets operations."""
     
     def __init__(self):
-        """Initialize Google Sheets client."""
-        self.creds_dict = get_google_credentials_dict()
-        self.creds = ServiceAccountCredentials.from_json_keyfile_dict(
-            self.creds_dict, GOOGLE_SCOPE
-        )
-        self.gc = gspread.authorize(self.creds)
-        self.sheet = self.gc.open(SHEET_NAME).sheet1
-    
-    def get_user_credentials(self, user_id: str) -> Optional[UserCredentials]:
-        """Get user credentials from Google Sheet."""
+        """Initialize lazily; the Sheets connection opens on first use."""
+        self._creds = None
+        self._gc = None
+        self._sheet = None
+
+        # In-memory credentials cache (Telegram ID -> UserCredentials)
+        self._cred_cache: Dict[str, UserCredentials] = {}
+        self._cred_cache_ts: float = 0.0
+
+        # Next row number, counted once on first save instead of
+        # re-fetching the whole sheet every time
+        self._next_no: Optional[int] = None
+
+        # Per-user record index (user_id -> records), rebuilt lazily
+        self._record_index: Optional[Dict[str, List[UserRecord]]] = None
+        self._record_index_ts: float = 0.0
+
+    @property
+    def creds(self):
+        """Service account credentials, parsed on first use."""
+        if self._creds is None:
+            self._creds = ServiceAccountCredentials.from_json_keyfile_dict(
+                get_google_credentials_dict(), GOOGLE_SCOPE
+            )
+        return self._creds
+
+    @property
+    def gc(self):
+        """Authorized gspread client, created on first use."""
+        if self._gc is None:
+            self._gc = gspread.authorize(self.creds)
+        return self._gc
+
+    @property
+    def sheet(self):
+        """Main worksheet, opened on first use."""
+        if self._sheet is None:
+            self._sheet = self.gc.open(SHEET_NAME).sheet1
+        return self._sheet
+
+    @property
+    def next_no(self) -> int:
+        """Next row number, counted once then tracked in-process."""
+        if self._next_no is None:
+            self._next_no = self._count_rows()
+        return self._next_no
+
+    @retry_on_quota_error
+    def _count_rows(self) -> int:
+        return len(self.sheet.col_values(1))
+
+    @retry_on_quota_error
+    def _refresh_credentials_cache(self):
+        """Refresh the credentials cache with a single sheet fetch."""
+        credentials_sheet = self.gc.open(SHEET_NAME).worksheet("Credentials")
+        records = credentials_sheet.get_all_records()
+
+        self._cred_cache = {
+            str(record.get('Telegram ID')): UserCredentials(record)
+            for record in records
+        }
+        self._cred_cache_ts = time.time()
+
+    def get_user_credentials(self, user_id: int) -> Optional[UserCredentials]:
+        """Get user credentials from Google Sheet (cached with TTL)."""
         try:
-            credentials_sheet = self.gc.open(SHEET_NAME).worksheet("Credentials")
-            records = credentials_sheet.get_all_records()
-            
-            for record in records:
-                if str(record.get('Telegram ID')) == str(user_id):
-                    return UserCredentials(record)
-            
-            return None
+            if time.time() - self._cred_cache_ts >= CREDENTIALS_CACHE_TTL:
+                self._refresh_credentials_cache()
+
+            return self._cred_cache.get(str(user_id))
         except Exception as e:
             logger.error(f"Error getting user credentials: {e}")
             return None
     
+    def _build_row(self, data: Dict, no: int) -> List:
+        """Build a spreadsheet row from collected user data."""
+        timestamp = format_timestamp()
+
+        # Base row data
+        row_data = [
+            no, timestamp, data['user_id'], data['nama_sa'], data['witel'],
+            data['telda'], data.get('sto', ''), data.get('odp', ''), data['cluster'], data['nama_usaha'],
+            data['jenis_usaha'], data['pic'], data.get('status_pic', ''), data['hpwa'], data['internet'],
+            data['kecepatan'], data['biaya'], data['voc'],
+            data.get('location', ''), data.get('file_link', ''),
+            data.get('link_gmaps', ''), "Default"
+        ]
+
+        # Add ODP-related columns if they exist (excluding certain fields)
+        excluded_odp_fields = ['odp_latitude', 'odp_longitude', 'odp_avai', 'odp_distance_km']
+        odp_columns = []
+        for key, value in data.items():
+            if (key.startswith('odp_') and
+                key not in ['odp_sto', 'odp_odp'] and  # Avoid duplicates with main fields
+                key not in excluded_odp_fields):  # Exclude specified fields
+                odp_columns.append(value if value is not None else '')
+
+        # Append ODP columns to row data
+        row_data.extend(odp_columns)
+        return row_data
+
+    @retry_on_quota_error
+    def _append_row(self, row: List):
+        self.sheet.append_row(row)
+
+    @retry_on_quota_error
+    def _append_rows(self, rows: List[List]):
+        self.sheet.append_rows(rows, value_input_option='USER_ENTERED')
+
     def save_to_spreadsheet(self, data: Dict) -> bool:
         """Save data to spreadsheet."""
         try:
-            timestamp = format_timestamp()
-            no = len(self.sheet.get_all_values())
-            
-            # Base row data
-            row_data = [
-                no, timestamp, data['user_id'], data['nama_sa'], data['witel'],
-                data['telda'], data.get('sto', ''), data.get('odp', ''), data['cluster'], data['nama_usaha'],
-                data['jenis_usaha'], data['pic'], data.get('status_pic', ''), data['hpwa'], data['internet'],
-                data['kecepatan'], data['biaya'], data['voc'],
-                data.get('location', ''), data.get('file_link', ''),
-                data.get('link_gmaps', ''), "Default"
-            ]
-            
-            # Add ODP-related columns if they exist (excluding certain fields)
-            excluded_odp_fields = ['odp_latitude', 'odp_longitude', 'odp_avai', 'odp_distance_km']
-            odp_columns = []
-            for key, value in data.items():
-                if (key.startswith('odp_') and
-                    key not in ['odp_sto', 'odp_odp'] and  # Avoid duplicates with main fields
-                    key not in excluded_odp_fields):  # Exclude specified fields
-                    odp_columns.append(value if value is not None else '')
-            
-            # Append ODP columns to row data
-            row_data.extend(odp_columns)
-            
-            self.sheet.append_row(row_data)
-            logger.info(f"Successfully saved data with {len(odp_columns)} additional ODP columns")
+            row_data = self._build_row(data, self.next_no)
+            self._append_row(row_data)
+            self._next_no += 1
+            self._invalidate_record_index()
+            logger.info("Successfully saved data to spreadsheet")
             return True
         except Exception as e:
             logger.error(f"Failed to save to spreadsheet: {e}")
             return False
+
+    def save_batch_to_spreadsheet(self, batch: List[Dict]) -> bool:
+        """Save several submissions in a single append_rows call."""
+        try:
+            rows = [
+                self._build_row(data, self.next_no + i)
+                for i, data in enumerate(batch)
+            ]
+
+            # Rows can be ragged (ODP extras vary per submission); pad to a
+            # uniform width so the batch lands as one rectangular range
+            width = max(len(row) for row in rows)
+            for row in rows:
+                row.extend([''] * (width - len(row)))
+
+            self._append_rows(rows)
+            self._next_no += len(rows)
+            self._invalidate_record_index()
+            logger.info(f"Successfully saved batch of {len(rows)} rows to spreadsheet")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save batch to spreadsheet: {e}")
+            return False
     
-    def get_user_records(self, user_id: str) -> List[UserRecord]:
-        """Get user's previous records from spreadsheet."""
+    @retry_on_quota_error
+    def _rebuild_record_index(self):
+        """Rebuild the per-user record index with one batchGet of the
+        required columns only, instead of downloading every column."""
+        columns = self.sheet.batch_get(RECORD_INDEX_RANGES)
+        columns = [
+            [row[0] if row else '' for row in column]
+            for column in columns
+        ]
+
+        index: Dict[str, List[UserRecord]] = {}
+        for no, timestamp, user_id, nama_usaha, pic in zip_longest(
+                *columns, fillvalue=''):
+            record = {
+                'No': no, 'Timestamp': timestamp, 'ID': user_id,
+                'Nama Usaha': nama_usaha, 'PIC': pic
+            }
+            index.setdefault(str(user_id), []).append(UserRecord(record))
+
+        self._record_index = index
+        self._record_index_ts = time.time()
+        return index
+
+    def _invalidate_record_index(self):
+        """Drop the record index after a write so it gets rebuilt."""
+        self._record_index = None
+
+    def get_user_records(self, user_id: int) -> List[UserRecord]:
+        """Get user's previous records from spreadsheet (cached index)."""
         try:
-            records = self.sheet.get_all_records()
-            user_records = []
-            
-            for record in records:
-                if str(record.get('ID')) == str(user_id):
-                    user_records.append(UserRecord(record))
-            
-            return user_records
+            # Work on a local snapshot: the append worker can null the
+            # shared index from its own thread at any moment
+            index = self._record_index
+            if (index is None or
+                    time.time() - self._record_index_ts >= RECORD_INDEX_TTL):
+                index = self._rebuild_record_index()
+
+            return index.get(str(user_id), [])
         except Exception as e:
             logger.error(f"Error getting user records: {e}")
             return []
     
+    @retry_on_quota_error
+    def _fetch_all_values(self, spreadsheet_name: str, sheet_name: str) -> List[List]:
+        return self.gc.open(spreadsheet_name).worksheet(sheet_name).get_all_values()
+
+    @retry_on_quota_error
+    def _fetch_range(self, spreadsheet_name: str, sheet_name: str,
+                     range_a1: str) -> List[List]:
+        return self.gc.open(spreadsheet_name).worksheet(sheet_name).get(range_a1)
+
     def get_sheet_data_by_name(self, spreadsheet_name: str, sheet_name: str) -> Optional[List[List]]:
         """Get data from a specific sheet by name."""
         try:
-            spreadsheet = self.gc.open(spreadsheet_name)
-            worksheet = spreadsheet.worksheet(sheet_name)
-            data = worksheet.get_all_values()
-            return data
+            return self._fetch_all_values(spreadsheet_name, sheet_name)
         except Exception as e:
             logger.error(f"Error getting data from sheet {sheet_name}: {e}")
             return None
 
+    def get_sheet_range(self, spreadsheet_name: str, sheet_name: str,
+                        range_a1: str) -> Optional[List[List]]:
+        """Get only the given A1 range from a sheet by name."""
+        try:
+            return self._fetch_range(spreadsheet_name, sheet_name, range_a1)
+        except Exception as e:
+            logger.error(f"Error getting range {range_a1} from sheet {sheet_name}: {e}")
+            return None
+
 # Global instance
 sheets_manager = GoogleSheetsManager()
 
-def get_user_credentials(user_id: str) -> Optional[Dict]:
+# Queue feeding the batched append worker (created by start_append_worker)
+_row_queue: Optional[asyncio.Queue] = None
+
+def start_append_worker(loop) -> None:
+    """Start the background task that batches spreadsheet appends."""
+    global _row_queue
+    _row_queue = asyncio.Queue()
+    loop.create_task(_append_worker())
+
+def start_token_refresh(loop) -> None:
+    """Start the background task that keeps the OAuth token warm."""
+    loop.create_task(_token_refresh_loop())
+
+async def _token_refresh_loop():
+    """Refresh the access token off the user-facing request path."""
+    while True:
+        await asyncio.sleep(TOKEN_REFRESH_INTERVAL)
+        try:
+            # gspread.authorize converts our service-account credentials
+            # into its own google-auth object; refresh that one, since
+            # it is what every request actually sends
+            await asyncio.to_thread(sheets_manager.gc.http_client.login)
+            logger.info("Refreshed Google API access token")
+        except Exception as e:
+            logger.error(f"Error refreshing Google API token: {e}")
+
+async def _append_worker():
+    """Drain queued submissions and write them in one append_rows call."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _row_queue.get()]
+        deadline = loop.time() + BATCH_MAX_WAIT
+
+        while len(batch) < BATCH_MAX_ROWS:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_row_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        rows = [data for data, _ in batch]
+        success = await asyncio.to_thread(
+            sheets_manager.save_batch_to_spreadsheet, rows
+        )
+        for _, future in batch:
+            if not future.done():
+                future.set_result(success)
+
+def get_user_credentials(user_id: int) -> Optional[Dict]:
     """Get user credentials from Google Sheet."""
     credentials = sheets_manager.get_user_credentials(user_id)
     return credentials.to_dict() if credentials else None
@@ -113,7 +338,19 @@ def save_to_spreadsheet(data: Dict) -> bool:
     """Save data to spreadsheet."""
     return sheets_manager.save_to_spreadsheet(data)
 
-def get_user_records(user_id: str) -> List[Dict]:
+async def save_to_spreadsheet_async(data: Dict) -> bool:
+    """Queue data for the batched append worker.
+
+    Falls back to a direct append if the worker is not running.
+    """
+    if _row_queue is None:
+        return await asyncio.to_thread(save_to_spreadsheet, data)
+
+    future = asyncio.get_running_loop().create_future()
+    _row_queue.put_nowait((data, future))
+    return await future
+
+def get_user_records(user_id: int) -> List[Dict]:
     """Get user's previous records from spreadsheet."""
     records = sheets_manager.get_user_records(user_id)
     return [
@@ -5,21 +5,22 @@ Contains all event handlers for the bot.
 
 import os
 import re
+import asyncio
 import logging
-from typing import Dict
+from cachetools import TTLCache
 from telethon import events
 from telethon.tl.types import MessageMediaPhoto
 
 from config import CHANNEL_ID
 from models import (
-    UserData, JENIS_USAHA, INTERNET_OPTIONS, 
+    UserData, Session, JENIS_USAHA, INTERNET_OPTIONS,
     KECEPATAN_OPTIONS, BIAYA_OPTIONS
 )
 
-from database import get_user_credentials, save_to_spreadsheet, get_user_records
+from database import get_user_credentials, save_to_spreadsheet_async, get_user_records
 from storage import upload_to_supabase
 from utils import (
-    create_buttons, extract_coords_from_gmaps_link,
+    create_buttons, extract_coords_from_gmaps_link_async,
     format_user_data_summary, format_channel_message,
     format_user_records, format_welcome_message
 )
@@ -27,10 +28,39 @@ from odp_service import odp_service
 
 logger = logging.getLogger(__name__)
 
-# Data storage
-user_data: Dict[str, UserData] = {}
-user_state: Dict[str, str] = {}
-odp_user_state: Dict[str, bool] = {}  # Track users waiting for ODP location input
+# Callback payload prefixes, matched with a cheap bytes startswith
+JENIS_PREFIX = b'jenis_'
+INTERNET_PREFIX = b'internet_'
+KECEPATAN_PREFIX = b'kecepatan_'
+BIAYA_PREFIX = b'biaya_'
+
+# Matches any of the Google Maps link hosts in one scan
+_GMAPS_RE = re.compile(r"maps\.google\.com|goo\.gl/maps|maps\.app\.goo\.gl")
+
+# Bound concurrent blocking I/O so bursts stay under API quotas and
+# don't exhaust the default thread pool
+SHEETS_SEM = asyncio.Semaphore(4)
+SUPABASE_SEM = asyncio.Semaphore(8)
+
+# Pre-built inline keyboards for the static option lists
+JENIS_BUTTONS = create_buttons(JENIS_USAHA, 'jenis')
+INTERNET_BUTTONS = create_buttons(INTERNET_OPTIONS, 'internet')
+KECEPATAN_BUTTONS = create_buttons(KECEPATAN_OPTIONS, 'kecepatan')
+BIAYA_BUTTONS = create_buttons(BIAYA_OPTIONS, 'biaya')
+
+# Text-entry steps: step -> (attr to set, next step, prompt, buttons)
+TEXT_STEPS = {
+    'nama_usaha': ('nama_usaha', 'pic', "👤 **Masukkan Nama PIC:**", None),
+    'pic': ('pic', 'status_pic', "🪪 **Masukkan status PIC:**", None),
+    'status_pic': ('status_pic', 'hpwa', "📱 **Masukkan Nomor HP/WA:**", None),
+    'hpwa': ('hpwa', 'jenis_usaha', "🏭 **Pilih Jenis Usaha:**", JENIS_BUTTONS),
+    'voc': ('voc', 'location', "📍 **Kirim Link Google Maps atau share lokasi Anda:**", None),
+}
+
+# Per-user sessions keyed by the raw int sender_id; one lookup per
+# event instead of separate state/data/ODP-flag dicts. Bounded with
+# an idle TTL so abandoned sessions don't accumulate forever.
+sessions: TTLCache = TTLCache(maxsize=10_000, ttl=7200)
 
 def setup_handlers(client):
     """Setup all bot handlers."""
@@ -38,10 +68,11 @@ def setup_handlers(client):
     @client.on(events.NewMessage(pattern='/start'))
     async def start_handler(event):
         """Handle /start command."""
-        user_id = str(event.sender_id)
-        user_state[user_id] = 'started'
-        
-        credentials = get_user_credentials(user_id)
+        user_id = event.sender_id
+        sessions.setdefault(user_id, Session()).state = 'started'
+
+        async with SHEETS_SEM:
+            credentials = await asyncio.to_thread(get_user_credentials, user_id)
         if not credentials:
             await event.reply("❌ Anda tidak terdaftar dalam sistem. Hubungi admin.")
             return
@@ -52,31 +83,35 @@ def setup_handlers(client):
     @client.on(events.NewMessage(pattern='/add'))
     async def add_handler(event):
         """Handle /add command."""
-        user_id = str(event.sender_id)
-        
-        if user_id not in user_state or user_state[user_id] != 'started':
+        user_id = event.sender_id
+        sess = sessions.get(user_id)
+
+        if sess is None or sess.state != 'started':
             await event.reply("Silakan ketik /start terlebih dahulu.")
             return
-        
-        credentials = get_user_credentials(user_id)
+
+        async with SHEETS_SEM:
+            credentials = await asyncio.to_thread(get_user_credentials, user_id)
         if not credentials:
             await event.reply("❌ Anda tidak terdaftar dalam sistem. Hubungi admin.")
             return
-        
-        user_data[user_id] = UserData(user_id, credentials)
-        user_state[user_id] = 'adding'
+
+        sess.data = UserData(user_id, credentials)
+        sess.state = 'adding'
         await event.reply("📝 **Masukkan Nama Usaha:**")
     
     @client.on(events.NewMessage(pattern='/record'))
     async def record_handler(event):
         """Handle /record command."""
-        user_id = str(event.sender_id)
-        
-        if user_id not in user_state or user_state[user_id] != 'started':
+        user_id = event.sender_id
+        sess = sessions.get(user_id)
+
+        if sess is None or sess.state != 'started':
             await event.reply("Silakan ketik /start terlebih dahulu.")
             return
-        
-        records = get_user_records(user_id)
+
+        async with SHEETS_SEM:
+            records = await asyncio.to_thread(get_user_records, user_id)
         message = format_user_records(records)
         await event.reply(message)
     
@@ -84,11 +119,11 @@ def setup_handlers(client):
     async def odp_handler(event):
         """Handle /odp command."""
         if event.is_private:
-            user_id = str(event.sender_id)
-            odp_user_state[user_id] = True
+            user_id = event.sender_id
+            sessions.setdefault(user_id, Session()).waiting_for_odp = True
             await event.reply("Silakan kirim link Google Maps atau share lokasi Anda untuk mencari ODP terdekat.")
     
-    async def process_odp_nearest(event, user_id: str, lat: float, lon: float):
+    async def process_odp_nearest(event, user_id: int, lat: float, lon: float):
         """Process ODP nearest search."""
         user_maps = f"https://www.google.com/maps?q={lat},{lon}"
         await event.reply(
@@ -96,7 +131,8 @@ def setup_handlers(client):
             parse_mode='markdown'
         )
         
-        nearest_odp = odp_service.find_nearest_odp(lat, lon)
+        async with SHEETS_SEM:
+            nearest_odp = await asyncio.to_thread(odp_service.find_nearest_odp, lat, lon)
         if nearest_odp is None:
             await event.reply("❌ Gagal mengambil data ODP dari Google Sheets.")
             return
@@ -108,221 +144,236 @@ def setup_handlers(client):
         message = odp_service.format_odp_results(nearest_odp)
         await event.reply(message, parse_mode='markdown')
     
-    @client.on(events.NewMessage())
+    async def send_odp_detection(event, data: UserData, lat: float, lon: float):
+        """Detect the nearest ODP for a collected location and report it."""
+        async with SHEETS_SEM:
+            odp_info = await asyncio.to_thread(
+                odp_service.get_complete_odp_info, lat, lon
+            )
+        if odp_info:
+            data.odp_info = odp_info
+            data.sto = odp_info.get("STO")
+            data.odp = odp_info.get("ODP")
+
+            # Format ODP information for user
+            odp_message = odp_service.format_odp_info_for_user(odp_info)
+            await event.reply(f"📍 **Lokasi diterima!**\n\n{odp_message}\n\n📸 **Kirim foto:**")
+        else:
+            await event.reply("📍 **Lokasi diterima!**\n⚠️ **Informasi ODP tidak dapat terdeteksi**\n\n📸 **Kirim foto:**")
+
+        data.step = 'photo'
+
+    async def handle_location(event, user_id: int, sess: Session):
+        """Handle shared locations (ODP search or data collection)."""
+        lat = event.message.geo.lat
+        lon = event.message.geo.long
+
+        # Check if user is waiting for ODP location
+        if sess.waiting_for_odp:
+            await process_odp_nearest(event, user_id, lat, lon)
+            sess.waiting_for_odp = False
+            return
+
+        # Handle regular data collection location
+        data = sess.data
+        if data is None or data.step != 'location':
+            return
+
+        data.location = f"{lat},{lon}"
+        data.link_gmaps = f"https://www.google.com/maps?q={lat},{lon}"
+        await send_odp_detection(event, data, lat, lon)
+
+    async def handle_gmaps_link(event, user_id: int, sess: Session):
+        """Handle Google Maps links (ODP search or data collection)."""
+        # Check if user is waiting for ODP location
+        if sess.waiting_for_odp:
+            coords_tuple = await extract_coords_from_gmaps_link_async(event.text.strip())
+            if coords_tuple:
+                lat, lon = coords_tuple
+                await process_odp_nearest(event, user_id, lat, lon)
+                sess.waiting_for_odp = False
+            else:
+                await event.reply("❌ Gagal mengekstrak koordinat dari link. Kirim ulang lokasi Anda.")
+            return
+
+        # Handle regular data collection Google Maps link
+        data = sess.data
+        if data is None or data.step != 'location':
+            return
+
+        data.link_gmaps = event.text
+        coords = await extract_coords_from_gmaps_link_async(event.text)
+        if coords:
+            lat, lon = coords
+            data.location = f"{lat},{lon}"
+            await send_odp_detection(event, data, lat, lon)
+        else:
+            await event.reply("❌ Gagal mengekstrak koordinat dari link. Kirim ulang lokasi Anda.")
+
+    @client.on(events.NewMessage(
+        func=lambda e: e.message.media.__class__ is not MessageMediaPhoto))
     async def message_handler(event):
-        """Handle text messages during data collection."""
-        user_id = str(event.sender_id)
-        
-        if user_id not in user_state:
+        """Dispatch incoming messages on the user's current state."""
+        user_id = event.sender_id
+        sess = sessions.get(user_id)
+
+        # Shared locations (ODP search or data collection)
+        if event.message.geo is not None:
+            if sess is not None:
+                await handle_location(event, user_id, sess)
+            return
+
+        text = event.text
+
+        # Google Maps links (ODP search or data collection)
+        if text and _GMAPS_RE.search(text):
+            if sess is not None:
+                await handle_gmaps_link(event, user_id, sess)
+            return
+
+        # Stickers, documents etc. carry no text; nothing to route
+        if not text:
+            return
+
+        if sess is None:
             await event.reply("Silakan ketik /start terlebih dahulu.")
             return
-        
-        if user_state.get(user_id) != 'adding':
+
+        if sess.state != 'adding':
             return
-        
-        if event.text and event.text.startswith('/'):
+
+        if text.startswith('/'):
             return
-        
-        current_data = user_data.get(user_id)
+
+        current_data = sess.data
         if not current_data:
             return
-        
-        current_step = current_data.step
-        
-        if current_step == 'nama_usaha':
-            current_data.nama_usaha = event.text
-            current_data.step = 'pic'
-            await event.reply("👤 **Masukkan Nama PIC:**")
-
-        elif current_step == 'pic':
-            current_data.pic = event.text
-            current_data.step = 'status_pic'
-            await event.reply("🪪 **Masukkan status PIC:**")
-        
-        elif current_step == 'status_pic':
-            current_data.status_pic = event.text
-            current_data.step = 'hpwa'
-            await event.reply("📱 **Masukkan Nomor HP/WA:**")
-        
-        elif current_step == 'hpwa':
-            current_data.hpwa = event.text
-            current_data.step = 'jenis_usaha'
-            buttons = create_buttons(JENIS_USAHA, 'jenis')
-            await event.reply("🏭 **Pilih Jenis Usaha:**", buttons=buttons)
-        
-        elif current_step == 'voc':
-            current_data.voc = event.text
-            current_data.step = 'location'
-            await event.reply("📍 **Kirim Link Google Maps atau share lokasi Anda:**")
+
+        entry = TEXT_STEPS.get(current_data.step)
+        if entry is None:
+            return
+
+        attr, next_step, prompt, buttons = entry
+        setattr(current_data, attr, text)
+        current_data.step = next_step
+        await event.reply(prompt, buttons=buttons)
     
-    @client.on(events.CallbackQuery(data=re.compile(r'jenis_(\d+)')))
+    @client.on(events.CallbackQuery(
+        func=lambda e: e.data and e.data.startswith(JENIS_PREFIX)))
     async def jenis_handler(event):
         """Handle jenis usaha button selection."""
-        user_id = str(event.sender_id)
-        index = int(event.pattern_match.group(1))
-        
-        if user_id in user_data:
-            user_data[user_id].jenis_usaha = JENIS_USAHA[index]
-            user_data[user_id].step = 'internet'
-            
-            buttons = create_buttons(INTERNET_OPTIONS, 'internet')
-            await event.edit("🌐 **Pilih Internet Existing:**", buttons=buttons)
+        user_id = event.sender_id
+        payload = event.data[len(JENIS_PREFIX):]
+        if not payload.isdigit():
+            return
+        index = int(payload)
+        if index >= len(JENIS_USAHA):
+            return
+
+        sess = sessions.get(user_id)
+        if sess and sess.data:
+            sess.data.jenis_usaha = JENIS_USAHA[index]
+            sess.data.step = 'internet'
+
+            await event.edit("🌐 **Pilih Internet Existing:**", buttons=INTERNET_BUTTONS)
     
-    @client.on(events.CallbackQuery(data=re.compile(r'internet_(\d+)')))
+    @client.on(events.CallbackQuery(
+        func=lambda e: e.data and e.data.startswith(INTERNET_PREFIX)))
     async def internet_handler(event):
         """Handle internet option button selection."""
-        user_id = str(event.sender_id)
-        index = int(event.pattern_match.group(1))
-        
-        if user_id in user_data:
-            user_data[user_id].internet = INTERNET_OPTIONS[index]
-            user_data[user_id].step = 'kecepatan'
-            
-            buttons = create_buttons(KECEPATAN_OPTIONS, 'kecepatan')
-            await event.edit("⚡ **Pilih Kecepatan Internet:**", buttons=buttons)
+        user_id = event.sender_id
+        payload = event.data[len(INTERNET_PREFIX):]
+        if not payload.isdigit():
+            return
+        index = int(payload)
+        if index >= len(INTERNET_OPTIONS):
+            return
+
+        sess = sessions.get(user_id)
+        if sess and sess.data:
+            sess.data.internet = INTERNET_OPTIONS[index]
+            sess.data.step = 'kecepatan'
+
+            await event.edit("⚡ **Pilih Kecepatan Internet:**", buttons=KECEPATAN_BUTTONS)
     
-    @client.on(events.CallbackQuery(data=re.compile(r'kecepatan_(\d+)')))
+    @client.on(events.CallbackQuery(
+        func=lambda e: e.data and e.data.startswith(KECEPATAN_PREFIX)))
     async def kecepatan_handler(event):
         """Handle kecepatan button selection."""
-        user_id = str(event.sender_id)
-        index = int(event.pattern_match.group(1))
-        
-        if user_id in user_data:
-            user_data[user_id].kecepatan = KECEPATAN_OPTIONS[index]
-            user_data[user_id].step = 'biaya'
-            
-            buttons = create_buttons(BIAYA_OPTIONS, 'biaya')
-            await event.edit("💰 **Pilih Range Biaya Internet:**", buttons=buttons)
-    
-    @client.on(events.CallbackQuery(data=re.compile(r'biaya_(\d+)')))
-    async def biaya_handler(event):
-        """Handle biaya button selection."""
-        user_id = str(event.sender_id)
-        index = int(event.pattern_match.group(1))
-        
-        if user_id in user_data:
-            user_data[user_id].biaya = BIAYA_OPTIONS[index]
-            user_data[user_id].step = 'voc'
-            
-            await event.edit("💬 **Masukkan Voice of Customer (VOC):**")
-    
-    @client.on(events.NewMessage(func=lambda e: hasattr(e.message, "geo") and e.message.geo))
-    async def location_handler(event):
-        """Handle location sharing."""
-        user_id = str(event.sender_id)
-        
-        # Check if user is waiting for ODP location
-        if odp_user_state.get(user_id):
-            lat = event.message.geo.lat
-            lon = event.message.geo.long
-            await process_odp_nearest(event, user_id, lat, lon)
-            odp_user_state[user_id] = False
+        user_id = event.sender_id
+        payload = event.data[len(KECEPATAN_PREFIX):]
+        if not payload.isdigit():
             return
-        
-        # Handle regular data collection location
-        if user_id not in user_data or user_data[user_id].step != 'location':
+        index = int(payload)
+        if index >= len(KECEPATAN_OPTIONS):
             return
-        
-        lat = event.message.geo.lat
-        lon = event.message.geo.long
-        user_data[user_id].location = f"{lat},{lon}"
-        user_data[user_id].link_gmaps = f"https://www.google.com/maps?q={lat},{lon}"
-        
-        # Get complete ODP information
-        odp_info = odp_service.get_complete_odp_info(lat, lon)
-        if odp_info:
-            user_data[user_id].odp_info = odp_info
-            user_data[user_id].sto = odp_info.get("STO")
-            user_data[user_id].odp = odp_info.get("ODP")
-            
-            # Format ODP information for user
-            odp_message = odp_service.format_odp_info_for_user(odp_info)
-            await event.reply(f"📍 **Lokasi diterima!**\n\n{odp_message}\n\n📸 **Kirim foto:**")
-        else:
-            await event.reply("📍 **Lokasi diterima!**\n⚠️ **Informasi ODP tidak dapat terdeteksi**\n\n📸 **Kirim foto:**")
-        
-        user_data[user_id].step = 'photo'
+
+        sess = sessions.get(user_id)
+        if sess and sess.data:
+            sess.data.kecepatan = KECEPATAN_OPTIONS[index]
+            sess.data.step = 'biaya'
+
+            await event.edit("💰 **Pilih Range Biaya Internet:**", buttons=BIAYA_BUTTONS)
     
-    @client.on(events.NewMessage(func=lambda e: 'maps.google.com' in e.text or 'goo.gl/maps' in e.text or 'maps.app.goo.gl' in e.text))
-    async def gmaps_handler(event):
-        """Handle Google Maps link."""
-        user_id = str(event.sender_id)
-        
-        # Check if user is waiting for ODP location
-        if odp_user_state.get(user_id):
-            coords_tuple = extract_coords_from_gmaps_link(event.text.strip())
-            if coords_tuple:
-                lat, lon = coords_tuple
-                await process_odp_nearest(event, user_id, lat, lon)
-                odp_user_state[user_id] = False
-            else:
-                await event.reply("❌ Gagal mengekstrak koordinat dari link. Kirim ulang lokasi Anda.")
+    @client.on(events.CallbackQuery(
+        func=lambda e: e.data and e.data.startswith(BIAYA_PREFIX)))
+    async def biaya_handler(event):
+        """Handle biaya button selection."""
+        user_id = event.sender_id
+        payload = event.data[len(BIAYA_PREFIX):]
+        if not payload.isdigit():
             return
-        
-        # Handle regular data collection Google Maps link
-        if user_id not in user_data or user_data[user_id].step != 'location':
+        index = int(payload)
+        if index >= len(BIAYA_OPTIONS):
             return
-        
-        user_data[user_id].link_gmaps = event.text
-        coords = extract_coords_from_gmaps_link(event.text)
-        if coords:
-            user_data[user_id].location = coords
-            
-            # Extract lat, lon from coords string for ODP detection
-            try:
-                lat, lon = map(float, coords.split(','))
-                
-                # Get complete ODP information
-                odp_info = odp_service.get_complete_odp_info(lat, lon)
-                if odp_info:
-                    user_data[user_id].odp_info = odp_info
-                    user_data[user_id].sto = odp_info.get("STO")
-                    user_data[user_id].odp = odp_info.get("ODP")
-                    
-                    # Format ODP information for user
-                    odp_message = odp_service.format_odp_info_for_user(odp_info)
-                    await event.reply(f"📍 **Lokasi diterima!**\n\n{odp_message}\n\n📸 **Kirim foto:**")
-                else:
-                    await event.reply("📍 **Lokasi diterima!**\n⚠️ **Informasi ODP tidak dapat terdeteksi**\n\n📸 **Kirim foto:**")
-                    
-            except (ValueError, AttributeError):
-                await event.reply("📍 **Lokasi diterima!**\n⚠️ **Informasi ODP tidak dapat terdeteksi**\n\n📸 **Kirim foto:**")
-            
-            user_data[user_id].step = 'photo'
-        else:
-            await event.reply("❌ Gagal mengekstrak koordinat dari link. Kirim ulang lokasi Anda.")
+
+        sess = sessions.get(user_id)
+        if sess and sess.data:
+            sess.data.biaya = BIAYA_OPTIONS[index]
+            sess.data.step = 'voc'
+
+            await event.edit("💬 **Masukkan Voice of Customer (VOC):**")
     
-    @client.on(events.NewMessage(func=lambda e: isinstance(e.message.media, MessageMediaPhoto)))
+    @client.on(events.NewMessage(
+        func=lambda e: e.message.media.__class__ is MessageMediaPhoto))
     async def photo_handler(event):
         """Handle photo upload."""
-        user_id = str(event.sender_id)
-        
-        if user_id not in user_data or user_data[user_id].step not in ['photo', 'complete']:
+        user_id = event.sender_id
+        sess = sessions.get(user_id)
+
+        if sess is None or sess.data is None or sess.data.step not in ['photo', 'complete']:
             return
-        
+
+        file_path = None
         try:
             # Download and upload photo
             file_path = await event.download_media()
-            file_link = upload_to_supabase(file_path)
-            user_data[user_id].file_link = file_link
-            os.remove(file_path)
+            async with SUPABASE_SEM:
+                file_link = await asyncio.to_thread(upload_to_supabase, file_path)
+            sess.data.file_link = file_link
         except Exception as e:
             logger.error(f"Error processing photo: {e}")
             file_link = "Gagal upload foto"
+        finally:
+            # Clean up the downloaded file even if the upload failed
+            if file_path:
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
         
         # Save data to spreadsheet
-        data_dict = user_data[user_id].to_dict()
-        if save_to_spreadsheet(data_dict):
-            # Send confirmation to user
-            summary_message = format_user_data_summary(data_dict)
-            await event.reply(summary_message)
-            
-            # Send notification to channel
-            channel_message = format_channel_message(data_dict)
-            await client.send_message(CHANNEL_ID, channel_message)
+        data_dict = sess.data.to_dict()
+        if await save_to_spreadsheet_async(data_dict):
+            # The confirmation and the channel notification are
+            # independent, so send them concurrently
+            await asyncio.gather(
+                event.reply(format_user_data_summary(data_dict)),
+                client.send_message(CHANNEL_ID, format_channel_message(data_dict))
+            )
         else:
             await event.reply("❌ Gagal menyimpan data ke spreadsheet")
         
-        # Reset user state
-        user_state[user_id] = 'started'
-        del user_data[user_id]
\ No newline at end of file
+        # Reset the session for the next entry
+        sess.state = 'started'
+        sess.data = None
\ No newline at end of file
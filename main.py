@@ -6,8 +6,17 @@ Entry point for the Telegram bot application.
 import logging
 from telethon import TelegramClient
 from config import API_ID, API_HASH, BOT_TOKEN
+from database import start_append_worker, start_token_refresh
 from handlers import setup_handlers
 
+# uvloop (libuv-backed event loop) is optional and Linux/macOS only;
+# install it before the client creates its loop
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    uvloop = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -26,7 +35,21 @@ def main():
     
     # Setup handlers
     setup_handlers(client)
-    
+
+    # Start the batched spreadsheet append worker and token refresh loop
+    start_append_worker(client.loop)
+    start_token_refresh(client.loop)
+
+    if uvloop is not None:
+        logger.info("uvloop enabled as the asyncio event loop")
+
+    # Telethon picks up cryptg automatically for fast MTProto AES
+    try:
+        import cryptg
+        logger.info(f"cryptg {cryptg.__version__} enabled for AES acceleration")
+    except ImportError:
+        logger.warning("cryptg not installed, using slower pure-Python AES")
+
     logger.info("Bot is starting...")
     
     # Run the bot
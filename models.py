@@ -3,7 +3,8 @@ Data models and constants for the Telegram bot.
 Contains data structures, column mappings, and option lists.
 """
 
-from typing import Dict, List
+from dataclasses import dataclass
+from typing import Dict, List, Optional
 
 # Column indices for spreadsheet
 COLUMNS = {
@@ -53,8 +54,15 @@ BIAYA_OPTIONS = [
 
 class UserData:
     """Data structure for user information during data collection."""
-    
-    def __init__(self, user_id: str, credentials: Dict):
+
+    __slots__ = (
+        'user_id', 'nama_sa', 'witel', 'telda', 'cluster', 'step',
+        'sto', 'odp', 'nama_usaha', 'pic', 'status_pic', 'hpwa',
+        'jenis_usaha', 'internet', 'kecepatan', 'biaya', 'voc',
+        'location', 'link_gmaps', 'file_link', 'odp_info'
+    )
+
+    def __init__(self, user_id: int, credentials: Dict):
         self.user_id = user_id
         self.nama_sa = credentials['nama_sa']
         self.witel = credentials['witel']
@@ -81,45 +89,43 @@ class UserData:
         # ODP information
         self.odp_info = None  # Will store complete ODP information as dict
     
+    # Fields serialized for spreadsheet storage, in sheet order
+    _FIELDS = (
+        'user_id', 'nama_sa', 'witel', 'telda', 'sto', 'odp', 'cluster',
+        'nama_usaha', 'pic', 'status_pic', 'hpwa', 'jenis_usaha',
+        'internet', 'kecepatan', 'biaya', 'voc', 'location',
+        'link_gmaps', 'file_link'
+    )
+
+    # ODP fields excluded from sheet storage
+    _EXCLUDED = frozenset({'LATITUDE', 'LONGITUDE', 'AVAI', 'DISTANCE_KM'})
+
     def to_dict(self) -> Dict:
         """Convert to dictionary for spreadsheet storage."""
-        data = {
-            'user_id': self.user_id,
-            'nama_sa': self.nama_sa,
-            'witel': self.witel,
-            'telda': self.telda,
-            'sto': self.sto,
-            'odp': self.odp,
-            'cluster': self.cluster,
-            'nama_usaha': self.nama_usaha,
-            'pic': self.pic,
-            'status_pic': self.status_pic,
-            'hpwa': self.hpwa,
-            'jenis_usaha': self.jenis_usaha,
-            'internet': self.internet,
-            'kecepatan': self.kecepatan,
-            'biaya': self.biaya,
-            'voc': self.voc,
-            'location': self.location,
-            'link_gmaps': self.link_gmaps,
-            'file_link': self.file_link
-        }
-        
+        data = {field: getattr(self, field) for field in self._FIELDS}
+
         # Add ODP information if available (excluding certain fields)
         if self.odp_info:
-            # Fields to exclude from sheet storage
-            excluded_fields = ['LATITUDE', 'LONGITUDE', 'AVAI', 'DISTANCE_KM']
-            
             for key, value in self.odp_info.items():
-                if key not in excluded_fields:
+                if key not in self._EXCLUDED:
                     # Add ODP fields with prefix to avoid conflicts
                     data[f'odp_{key.lower()}'] = value
-        
+
         return data
 
+@dataclass(slots=True)
+class Session:
+    """Per-user conversation session: state, collected data and ODP flag."""
+
+    state: str = 'new'
+    data: Optional[UserData] = None
+    waiting_for_odp: bool = False
+
 class UserCredentials:
     """Data structure for user credentials from Google Sheet."""
-    
+
+    __slots__ = ('kode', 'nama_sa', 'witel', 'telda', 'cluster')
+
     def __init__(self, record: Dict):
         self.kode = record.get('Kode SA')
         self.nama_sa = record.get('Nama')
@@ -139,7 +145,9 @@ class UserCredentials:
 
 class UserRecord:
     """Data structure for user's previous records."""
-    
+
+    __slots__ = ('no', 'nama_usaha', 'pic', 'timestamp')
+
     def __init__(self, record: Dict):
         self.no = record.get('No')
         self.nama_usaha = record.get('Nama Usaha')
@@ -4,28 +4,79 @@ Handles ODP location search and distance calculations.
 """
 
 import logging
+import time
+import numpy as np
 import pandas as pd
-from typing import Optional, List, Dict
-from geopy.distance import geodesic
+from typing import Optional, Dict
 from database import sheets_manager
 from config import SHEET_NAME
 
+try:
+    from sklearn.neighbors import BallTree
+except ImportError:
+    BallTree = None
+
 logger = logging.getLogger(__name__)
 
+# Mean Earth radius in km for the haversine distance
+EARTH_RADIUS_KM = 6371.0088
+
+# How long the cached ODP table stays valid (seconds)
+ODP_CACHE_TTL = 300
+
+# Columns fetched from the ODP tab; queries only use STO, ODP,
+# LATITUDE, LONGITUDE and AVAI, which all sit in this range
+ODP_SHEET_RANGE = "A1:F"
+
+# Max memoized nearest-ODP query results between table refreshes
+QUERY_CACHE_MAX = 128
+
 class ODPService:
     """Service for ODP-related operations."""
     
     def __init__(self):
         self.spreadsheet_name = SHEET_NAME
-    
+
+        # Cached ODP table, refetched at most once per TTL window
+        self._df: Optional[pd.DataFrame] = None
+        self._df_ts: float = 0.0
+
+        # Struct-of-arrays query cache built at each refresh: metadata
+        # rows, radian coordinate arrays and the optional BallTree,
+        # published as one (meta, lat, lon, tree) tuple so concurrent
+        # queries on worker threads never see a half-built state
+        self._query_data: Optional[tuple] = None
+
+        # Memoized query results, replaced on each table refresh
+        self._query_cache: Dict = {}
+
     def get_odp_dataframe(self) -> Optional[pd.DataFrame]:
-        """Get ODP data from Google Sheets tab 'ODP'."""
+        """Get ODP data from Google Sheets tab 'ODP' (cached with TTL)."""
+        if (self._df is not None and
+                time.monotonic() - self._df_ts < ODP_CACHE_TTL):
+            return self._df
+
         try:
-            data = sheets_manager.get_sheet_data_by_name(self.spreadsheet_name, "ODP")
+            data = sheets_manager.get_sheet_range(
+                self.spreadsheet_name, "ODP", ODP_SHEET_RANGE
+            )
             if data and len(data) > 1:
+                # worksheet.get trims trailing empty cells; pad rows back
+                # to header width
                 headers = data[0]
-                rows = data[1:]
+                width = len(headers)
+                rows = [row + [''] * (width - len(row)) for row in data[1:]]
                 df = pd.DataFrame(rows, columns=headers)
+
+                # Parse coordinates once at cache time so queries skip
+                # the per-call float conversion
+                for col in ("LATITUDE", "LONGITUDE"):
+                    if col in df.columns:
+                        df[col] = pd.to_numeric(df[col], errors='coerce')
+
+                self._build_query_cache(df)
+                self._df = df
+                self._df_ts = time.monotonic()
                 logger.info(f"Successfully loaded {len(df)} rows from sheet: ODP")
                 return df
             else:
@@ -35,19 +86,11 @@ class ODPService:
             logger.error(f"Error getting data from sheet ODP: {e}")
             return None
     
-    def find_nearest_odp(self, user_lat: float, user_lon: float, limit: int = 5) -> Optional[pd.DataFrame]:
-        """Find nearest ODP locations to user coordinates."""
-        df = self.get_odp_dataframe()
-        if df is None:
-            return None
-        
-        if not all(col in df.columns for col in ["STO", "ODP", "LATITUDE", "LONGITUDE"]):
-            logger.error("ODP data missing required columns")
-            return None
-        
-        try:
-            user_location = (user_lat, user_lon)
-            
+    def _build_query_cache(self, df: pd.DataFrame):
+        """Build the struct-of-arrays layout used for nearest queries."""
+        query_data = None
+
+        if all(col in df.columns for col in ["STO", "ODP", "LATITUDE", "LONGITUDE"]):
             # Ensure AVAI column exists
             columns_needed = ["STO", "ODP", "LATITUDE", "LONGITUDE"]
             if "AVAI" in df.columns:
@@ -55,58 +98,121 @@ class ODPService:
             else:
                 df["AVAI"] = "N/A"
                 columns_needed.append("AVAI")
-            
-            # Filter out rows with missing data
-            locations = df[columns_needed].dropna(subset=["STO", "ODP", "LATITUDE", "LONGITUDE"])
-            
-            # Convert lat/lon to float for distance calculation
-            locations["LATITUDE"] = locations["LATITUDE"].astype(float)
-            locations["LONGITUDE"] = locations["LONGITUDE"].astype(float)
-            
-            # Calculate distances
-            locations["DISTANCE_KM"] = locations.apply(
-                lambda row: geodesic(user_location, (row["LATITUDE"], row["LONGITUDE"])).km,
-                axis=1
-            )
-            
-            # Return nearest locations
-            nearest = locations.sort_values(by="DISTANCE_KM").head(limit)
+
+            # Filter out rows with missing data; coordinates are already
+            # numeric from the cache refresh
+            meta = df[columns_needed].dropna(
+                subset=["STO", "ODP", "LATITUDE", "LONGITUDE"]
+            ).reset_index(drop=True)
+
+            lat = np.radians(meta["LATITUDE"].to_numpy(dtype=np.float64))
+            lon = np.radians(meta["LONGITUDE"].to_numpy(dtype=np.float64))
+
+            tree = None
+            if BallTree is not None and len(meta) > 0:
+                tree = BallTree(
+                    np.column_stack((lat, lon)), metric='haversine'
+                )
+
+            query_data = (meta, lat, lon, tree)
+        else:
+            logger.error("ODP data missing required columns")
+
+        # Single assignments: in-flight queries keep the snapshot they
+        # took, new ones pick up the fresh data and an empty memo
+        self._query_data = query_data
+        self._query_cache = {}
+
+    def find_nearest_odp(self, user_lat: float, user_lon: float, limit: int = 5) -> Optional[pd.DataFrame]:
+        """Find nearest ODP locations to user coordinates."""
+        if self.get_odp_dataframe() is None:
+            return None
+
+        # Snapshot the published cache once; a concurrent refresh then
+        # cannot pull the arrays out from under this query
+        query_data = self._query_data
+        if query_data is None:
+            return None
+        meta, lat_arr, lon_arr, tree = query_data
+
+        # Repeated lookups for the same spot (display plus data entry)
+        # are served from the memo until the table refreshes
+        cache_key = (round(user_lat, 5), round(user_lon, 5), limit)
+        nearest = self._query_cache.get(cache_key)
+        if nearest is not None:
             return nearest
-            
+
+        try:
+            user_lat_r = np.radians(user_lat)
+            user_lon_r = np.radians(user_lon)
+
+            # Spatial index: O(log N) per query when sklearn is present
+            if tree is not None:
+                k = min(limit, len(meta))
+                d, idx = tree.query([[user_lat_r, user_lon_r]], k=k)
+                nearest = meta.iloc[idx[0]].copy()
+                nearest["DISTANCE_KM"] = d[0] * EARTH_RADIUS_KM
+                self._store_query_result(cache_key, nearest)
+                return nearest
+
+            # Rank with a cheap equirectangular approximation (error is
+            # well under 0.5% at city scale), partitioning out the k
+            # nearest without sorting the whole table
+            dx = np.cos(user_lat_r) * (lon_arr - user_lon_r)
+            dy = lat_arr - user_lat_r
+            d2 = dx * dx + dy * dy
+
+            k = min(limit, len(d2))
+            if k == 0:
+                nearest = meta.copy()
+                nearest["DISTANCE_KM"] = d2
+                return nearest
+            order = np.argpartition(d2, k - 1)[:k]
+            order = order[np.argsort(d2[order])]
+
+            # Exact haversine only for the selected rows
+            lat_k = lat_arr[order]
+            dlat = lat_k - user_lat_r
+            dlon = lon_arr[order] - user_lon_r
+            a = (np.sin(dlat / 2) ** 2 +
+                 np.cos(user_lat_r) * np.cos(lat_k) * np.sin(dlon / 2) ** 2)
+
+            nearest = meta.iloc[order].copy()
+            nearest["DISTANCE_KM"] = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+            self._store_query_result(cache_key, nearest)
+            return nearest
+
         except Exception as e:
             logger.error(f"Error calculating ODP distances: {e}")
             return None
+
+    def _store_query_result(self, cache_key, nearest: pd.DataFrame):
+        """Memoize a query result, keeping the memo bounded."""
+        if len(self._query_cache) >= QUERY_CACHE_MAX:
+            self._query_cache.clear()
+        self._query_cache[cache_key] = nearest
     
     def format_odp_results(self, nearest_odp: pd.DataFrame) -> str:
         """Format ODP results for display."""
         if nearest_odp is None or nearest_odp.empty:
             return "❌ Tidak ada data ODP yang ditemukan."
         
-        msg = "\n=== 5 ODP Terdekat ===\n"
-        for i, row in enumerate(nearest_odp.itertuples(index=False), 1):
-            sto = getattr(row, 'STO', 'N/A')
-            odp = getattr(row, 'ODP', '-')
-            lat = getattr(row, 'LATITUDE', 0.0)
-            lon = getattr(row, 'LONGITUDE', 0.0)
-            dist = getattr(row, 'DISTANCE_KM', 0.0)
-            avai = getattr(row, 'AVAI', 'N/A')
-            
-            try:
-                lat_float = float(str(lat)) if lat else 0.0
-                lon_float = float(str(lon)) if lon else 0.0
-            except (ValueError, TypeError):
-                lat_float = 0.0
-                lon_float = 0.0
-            
-            dist_meter = dist * 1000
-            odp_maps = f"https://www.google.com/maps?q={lat_float},{lon_float}"
-            
-            msg += (
-                f"{i}. {odp} | {lat_float:.6f},{lon_float:.6f} | {dist_meter:.2f} m | "
+        # The columns already hold floats; zip the raw values and join
+        # once instead of growing the message string per row
+        parts = ["\n=== 5 ODP Terdekat ===\n"]
+        rows = zip(
+            nearest_odp["ODP"].values, nearest_odp["LATITUDE"].values,
+            nearest_odp["LONGITUDE"].values, nearest_odp["DISTANCE_KM"].values,
+            nearest_odp["AVAI"].values
+        )
+        for i, (odp, lat, lon, dist, avai) in enumerate(rows, 1):
+            odp_maps = f"https://www.google.com/maps?q={lat},{lon}"
+            parts.append(
+                f"{i}. {odp} | {lat:.6f},{lon:.6f} | {dist * 1000:.2f} m | "
                 f"Port Tersedia: {avai} | [Lihat di Maps]({odp_maps})\n"
             )
-        
-        return msg
+
+        return "".join(parts)
     
     def get_complete_odp_info(self, user_lat: float, user_lon: float) -> Optional[Dict]:
         """Get complete ODP information from the nearest ODP location."""
@@ -118,12 +224,12 @@ class ODPService:
             # Get the first (nearest) ODP
             first_row = nearest_odp.iloc[0]
             
-            # Create a dictionary with all available ODP information
+            # Create a dictionary with all available ODP information,
+            # keeping native types (coordinates stay float64 from ingest)
             odp_info = {}
             for column in nearest_odp.columns:
                 value = first_row[column]
-                # Convert to string and handle empty values
-                odp_info[column] = str(value) if pd.notna(value) and value != '' else None
+                odp_info[column] = value if pd.notna(value) and value != '' else None
             
             logger.info(f"Found complete ODP info: {odp_info}")
             return odp_info
@@ -144,37 +250,32 @@ class ODPService:
         if not odp_info:
             return "❌ Informasi ODP tidak tersedia."
         
-        msg = "📍 **Informasi ODP Terdekat:**\n\n"
-        
+        parts = ["📍 **Informasi ODP Terdekat:**\n\n"]
+
         # Priority fields to show first
         priority_fields = ["STO", "ODP", "LATITUDE", "LONGITUDE", "DISTANCE_KM", "AVAI"]
-        
-        # Show priority fields first
+
+        # Show priority fields first; the numeric fields hold floats
+        # from ingest so no defensive re-parsing is needed
         for field in priority_fields:
             if field in odp_info and odp_info[field] is not None:
                 if field == "DISTANCE_KM":
-                    try:
-                        distance_m = float(odp_info[field]) * 1000
-                        msg += f"🔹 **Jarak:** {distance_m:.2f} meter\n"
-                    except (ValueError, TypeError):
-                        msg += f"🔹 **{field}:** {odp_info[field]}\n"
+                    parts.append(f"🔹 **Jarak:** {odp_info[field] * 1000:.2f} meter\n")
                 elif field == "AVAI":
-                    msg += f"🔹 **Port Tersedia:** {odp_info[field]}\n"
+                    parts.append(f"🔹 **Port Tersedia:** {odp_info[field]}\n")
                 elif field in ["LATITUDE", "LONGITUDE"]:
-                    try:
-                        coord = float(odp_info[field])
-                        msg += f"🔹 **{field}:** {coord:.6f}\n"
-                    except (ValueError, TypeError):
-                        msg += f"🔹 **{field}:** {odp_info[field]}\n"
+                    parts.append(f"🔹 **{field}:** {odp_info[field]:.6f}\n")
                 else:
-                    msg += f"🔹 **{field}:** {odp_info[field]}\n"
-        
+                    parts.append(f"🔹 **{field}:** {odp_info[field]}\n")
+
         # Show other fields
-        for field, value in odp_info.items():
-            if field not in priority_fields and value is not None:
-                msg += f"🔹 **{field}:** {value}\n"
-        
-        return msg
+        parts.extend(
+            f"🔹 **{field}:** {value}\n"
+            for field, value in odp_info.items()
+            if field not in priority_fields and value is not None
+        )
+
+        return "".join(parts)
 
 # Global instance
 odp_service = ODPService()
\ No newline at end of file
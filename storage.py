@@ -16,17 +16,24 @@ class SupabaseStorageManager:
     """Manages Supabase storage operations."""
     
     def __init__(self):
-        """Initialize Supabase client."""
+        """Initialize lazily; the client is created on first upload."""
         self.supabase_url = SUPABASE_URL
         self.supabase_key = SUPABASE_KEY
         self.bucket_name = SUPABASE_BUCKET
-        self.client = None
-        
-        if self.supabase_url and self.supabase_key:
+        self._client = None
+        self._client_failed = False
+
+    @property
+    def client(self):
+        """Supabase client, created on first use."""
+        if (self._client is None and not self._client_failed
+                and self.supabase_url and self.supabase_key):
             try:
-                self.client = create_client(self.supabase_url, self.supabase_key)
+                self._client = create_client(self.supabase_url, self.supabase_key)
             except Exception as e:
                 logger.error(f"Failed to initialize Supabase client: {e}")
+                self._client_failed = True
+        return self._client
     
     def upload_file(self, file_path: str) -> str:
         """Upload file to Supabase storage."""
@@ -38,22 +45,25 @@ class SupabaseStorageManager:
             file_extension = os.path.splitext(file_path)[1]
             unique_filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}{file_extension}"
             
-            # Read file data
+            # Upload to Supabase, streaming from the file handle instead
+            # of reading the whole image into memory first
             with open(file_path, 'rb') as f:
-                file_data = f.read()
-            
-            # Upload to Supabase
-            response = self.client.storage.from_(self.bucket_name).upload(
-                path=unique_filename,
-                file=file_data,
-                file_options={"content-type": "image/jpeg"}
-            )
+                response = self.client.storage.from_(self.bucket_name).upload(
+                    path=unique_filename,
+                    file=f,
+                    file_options={"content-type": "image/jpeg"}
+                )
             
             if response:
-                # Get public URL
-                public_url = self.client.storage.from_(self.bucket_name).get_public_url(unique_filename)
-                return public_url
-            
+                # The bucket is public and the path deterministic, so
+                # build the URL locally instead of a second round-trip
+                if self.supabase_url:
+                    return (
+                        f"{self.supabase_url.rstrip('/')}/storage/v1/object/public/"
+                        f"{self.bucket_name}/{unique_filename}"
+                    )
+                return self.client.storage.from_(self.bucket_name).get_public_url(unique_filename)
+
             return "Foto tersimpan (gagal upload)"
             
         except Exception as e:
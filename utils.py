@@ -4,6 +4,7 @@ Contains helper functions for coordinate extraction, button creation, etc.
 """
 
 import re
+import asyncio
 import requests
 import logging
 from typing import List, Optional, Tuple
@@ -11,6 +12,24 @@ from telethon import Button
 
 logger = logging.getLogger(__name__)
 
+# Shared HTTP session for connection pooling / keep-alive
+_session = requests.Session()
+_session.headers.update({"User-Agent": "Mozilla/5.0"})
+
+# One compiled pattern for every coordinate form Maps uses:
+# @lat,lon (place URLs), q=lat,lon (query URLs) and !3dlat!4dlon
+# (embedded preview data)
+_COORDS_PATTERN = r"(?:@|[?&]q=|!3d)(-?\d+\.\d+)(?:,|%2C|!4d)(-?\d+\.\d+)"
+_COORDS_RE = re.compile(_COORDS_PATTERN)
+
+# RE2 scans in guaranteed linear time; worth it for the HTML body
+# fallback, while short URLs stay on the stdlib engine
+try:
+    import re2
+    _BODY_COORDS_RE = re2.compile(_COORDS_PATTERN)
+except ImportError:
+    _BODY_COORDS_RE = _COORDS_RE
+
 def create_buttons(options: List[str], prefix: str) -> List[List[Button]]:
     """Create inline buttons from options."""
     buttons = []
@@ -22,35 +41,60 @@ def create_buttons(options: List[str], prefix: str) -> List[List[Button]]:
             row = []
     return buttons
 
-def extract_coords_from_gmaps_link(link: str) -> Tuple[Optional[float], Optional[float]]:
-    """Extract latitude and longitude from Google Maps short or long link."""
+# Resolved links, successes only so transient network failures are
+# retried rather than pinned
+_coords_cache: dict = {}
+COORDS_CACHE_MAX = 512
+
+def extract_coords_from_gmaps_link(link: str) -> Optional[Tuple[float, float]]:
+    """Extract (latitude, longitude) from a Google Maps short or long link.
+
+    Returns None when no coordinates can be found, so callers can
+    test the result directly.
+    """
     if not link or not link.strip():
-        return None, None
+        return None
+
+    cached = _coords_cache.get(link)
+    if cached is not None:
+        return cached
+
+    coords = _resolve_coords(link)
+    if coords is not None:
+        if len(_coords_cache) >= COORDS_CACHE_MAX:
+            _coords_cache.clear()
+        _coords_cache[link] = coords
+    return coords
+
+def _resolve_coords(link: str) -> Optional[Tuple[float, float]]:
+    """Resolve a Maps link over HTTP and scan for coordinates."""
     try:
-        # follow redirects to get the final URL page
-        headers = {
-            "User-Agent": "Mozilla/5.0"
-        }
-        response = requests.get(link, headers=headers, allow_redirects=True, timeout=50)
-        html = response.text
-        # Try to extract lat,lng from embed or preview URLs
-        match = re.search(
-            r"https://www\.google\.com/maps/preview/place/.*?@(-?\d+\.\d+),(-?\d+\.\d+)",
-            html
-        )
+        # Resolve redirects with a body-less HEAD first; the final URL
+        # usually carries the coordinates already
+        response = _session.head(link, allow_redirects=True, timeout=10)
+        match = _COORDS_RE.search(response.url)
         if match:
-            lat, lng = match.groups()
-            return float(lat), float(lng)
-        # fallback: try plain lat,lng patterns in URL or page
-        full_url = response.url
-        match2 = re.search(r"[?&]q=(-?\d+\.\d+),(-?\d+\.\d+)", full_url)
-        if match2:
-            lat, lng = match2.groups()
-            return float(lat), float(lng)
+            return float(match[1]), float(match[2])
+
+        # Fallback: stream the page and scan only its first 32 KB plus
+        # the final URL; coordinates sit near the top when present
+        response = _session.get(link, allow_redirects=True, timeout=10, stream=True)
+        try:
+            head = response.raw.read(32768, decode_content=True)
+        finally:
+            response.close()
+        match = (_BODY_COORDS_RE.search(head.decode('utf-8', 'ignore')) or
+                 _COORDS_RE.search(response.url))
+        if match:
+            return float(match[1]), float(match[2])
     except Exception as e:
         logger.error(f"Error extracting coordinates from link {link}: {e}")
-    
-    return None, None
+
+    return None
+
+async def extract_coords_from_gmaps_link_async(link: str) -> Optional[Tuple[float, float]]:
+    """Resolve a Maps link in a worker thread, keeping the event loop free."""
+    return await asyncio.to_thread(extract_coords_from_gmaps_link, link)
 
 def format_user_data_summary(data: dict) -> str:
     """Format user data for display in confirmation message."""
@@ -88,14 +132,15 @@ def format_user_records(records: List[dict]) -> str:
     if not records:
         return "📭 Anda belum memiliki data yang tersimpan."
     
-    message = "📋 **Data yang pernah Anda input:**\n\n"
-    for record in records:
-        message += f"🔹 No: {record['no']}\n"
-        message += f"🏢 Usaha: {record['nama_usaha']}\n"
-        message += f"👤 PIC: {record['pic']}\n"
-        message += f"📅 Waktu: {record['timestamp']}\n\n"
-    
-    return message
+    parts = ["📋 **Data yang pernah Anda input:**\n\n"]
+    parts.extend(
+        f"🔹 No: {record['no']}\n"
+        f"🏢 Usaha: {record['nama_usaha']}\n"
+        f"👤 PIC: {record['pic']}\n"
+        f"📅 Waktu: {record['timestamp']}\n\n"
+        for record in records
+    )
+    return "".join(parts)
 
 def format_welcome_message(credentials: dict) -> str:
     """Format welcome message with user credentials."""